@@ -1,8 +1,10 @@
 from typing import Iterable
 
+from toposort import toposort
+
 from dbsamizdat.samizdat import Samizdat
 
-from .libgraph import gen_autorefresh_edges, gen_edges, gen_unmanaged_edges, toposort, unmanaged_refs
+from .libgraph import gen_autorefresh_edges, gen_edges, gen_unmanaged_edges, unmanaged_refs
 from .samtypes import entitypes
 from .util import nodenamefmt
 
@@ -2,6 +2,7 @@ import warnings
 from enum import IntFlag
 from json import loads as jsonloads
 from typing import Iterable, NamedTuple
+from weakref import WeakValueDictionary
 
 from dbsamizdat.loader import SamizType, filter_sds
 from dbsamizdat.samizdat import Samizdat
@@ -102,51 +103,59 @@ def get_dbstate(
             """,
     }
 
-    for fetch_query in fetches.values():
-        cursor.execute(fetch_query)
-        items = (StateTuple(*c) for c in cursor.fetchall())
-        # Comment is the last item in the query
-        for item in items:
-            if not (item.commentcontent and item.commentcontent.startswith(COMMENT_MAGIC)):
-                continue
-            try:
-                meta = jsonloads(item.commentcontent)["dbsamizdat"]
-                # This is probably? a DBSamizdat
-                # Get the hash value from the comment
-                hashattr = "sql_template_hash" if meta["version"] == 0 else "definition_hash"
-                yield item._replace(definition_hash=meta[hashattr])
-            except Exception as E:
-                warnings.warn(f"{E}")
-                continue
+    # One round trip for all entity types. Filtering on the comment stays in Python:
+    # pushing a LIKE into the union makes Postgres call obj_description() for every catalog row.
+    cursor.execute("UNION ALL".join(fetches.values()))
+    items = (StateTuple(*c) for c in cursor.fetchall())
+    for item in items:
+        if not (item.commentcontent and item.commentcontent.startswith(COMMENT_MAGIC)):
+            continue
+        try:
+            meta = jsonloads(item.commentcontent)["dbsamizdat"]
+            # This is probably? a DBSamizdat
+            # Get the hash value from the comment
+            hashattr = "sql_template_hash" if meta["version"] == 0 else "definition_hash"
+            yield item._replace(definition_hash=meta[hashattr])
+        except Exception as E:
+            warnings.warn(f"{E}")
+            continue
+
+
+ENTITY_CLASSES: dict[entitypes, type[Samizdat]] = {
+    c.entity_type: c
+    for c in (
+        SamizdatView,
+        SamizdatMaterializedView,
+        SamizdatFunction,
+        SamizdatTrigger,
+    )
+}
+
+# Equal DB information gets the same class, for as long as someone holds on to it
+_reconstructed_classes: WeakValueDictionary[tuple, type[Samizdat]] = WeakValueDictionary()
 
 
 def dbinfo_to_class(info: StateTuple) -> type[Samizdat]:
     """
     Reconstruct a class out of information found in the DB
     """
-    typemap = {
-        c.entity_type: c
-        for c in (
-            SamizdatView,
-            SamizdatMaterializedView,
-            SamizdatFunction,
-            SamizdatTrigger,
-        )
-    }
+    key = (info.schemaname, info.viewname, info.objecttype, info.args, info.definition_hash)
+    if (klass := _reconstructed_classes.get(key)) is not None:
+        return klass
 
     entity_type = entitypes[info.objecttype]
     classfields: dict[str, None | str | tuple[str, str]] = dict(
         schema=info.schemaname,
         implanted_hash=str(info.definition_hash),
     )
-    if entity_type == entitypes.FUNCTION:
+    if entity_type is entitypes.FUNCTION:
         classfields.update(
             dict(
                 function_arguments_signature=str(info.args),
                 function_name=info.viewname,
             )
         )
-    elif entity_type == entitypes.TRIGGER:
+    elif entity_type is entitypes.TRIGGER:
         table = str(info.args)
         classfields.update(
             dict(
@@ -154,7 +163,8 @@ def dbinfo_to_class(info: StateTuple) -> type[Samizdat]:
                 on_table=(info.schemaname, table),
             )
         )
-    klass: type[Samizdat] = type(info.viewname, (typemap[entitypes[info.objecttype]],), classfields)
+    klass = type(info.viewname, (ENTITY_CLASSES[entity_type],), classfields)
+    _reconstructed_classes[key] = klass
     return klass
 
 
@@ -164,23 +174,27 @@ class DBComparison(NamedTuple):
     excess_definedstate: Iterable[SamizType]
 
 
-def dbstate_equals_definedstate(cursor: Cursor, samizdats: Iterable[SamizType]):
+def dbstate_equals_definedstate(
+    cursor: Cursor, samizdats: Iterable[SamizType], dbstate: Iterable[StateTuple] | None = None
+):
     """
     Returns whether there are id's to add or remove and if so which
-    samizdat classes (by id) need to be added or removed to sync database
+    samizdat classes (by id) need to be added or removed to sync database.
+    Pass `dbstate` if you've already fetched it with `get_dbstate`
+    and haven't changed the database since.
     """
 
-    current_state = get_dbstate(cursor)
+    current_state = get_dbstate(cursor) if dbstate is None else dbstate
     state_to_classes = (dbinfo_to_class(s) for s in current_state)
 
-    dbstate = {ds.head_id(): ds for ds in state_to_classes if filter_sds(ds)}
+    db_samizdats = {ds.head_id(): ds for ds in state_to_classes if filter_sds(ds)}
     definedstate = {ds.head_id(): ds for ds in samizdats}
 
-    db_keys = dbstate.keys()
+    db_keys = db_samizdats.keys()
     defined_keys = definedstate.keys()
 
     return DBComparison(
         issame=db_keys == defined_keys,
-        excess_dbstate={dbstate[k] for k in db_keys - defined_keys},
+        excess_dbstate={db_samizdats[k] for k in db_keys - defined_keys},
         excess_definedstate={definedstate[k] for k in defined_keys - db_keys},
     )
@@ -1,16 +1,27 @@
-from collections import Counter
+from collections import Counter, deque
 from functools import reduce
 from itertools import chain
 from operator import or_
-from typing import Iterable
-
-from toposort import CircularDependencyError, toposort
+from typing import Iterable, cast
+from weakref import ref
 
 from dbsamizdat.loader import SamizType, filter_sds
 from dbsamizdat.samizdat import Samizdat, SamizdatWithSidekicks
+from dbsamizdat.samtypes import FQTuple
 
 from .exceptions import DanglingReferenceError, DependencyCycleError, NameClashError, TypeConfusionError
 
+# Results of earlier sorts and checks, keyed on the set of samizdats they were run on.
+# Only weak references are kept: samizdats are discovered through `__subclasses__`,
+# and a cache holding on to (test) classes would keep them discoverable forever.
+MEMO_MAXSIZE = 128
+_sorted_memo: dict[frozenset, tuple] = {}
+_sane_memo: set[frozenset] = set()
+
+
+def memo_key(samizdats: Iterable[SamizType]) -> frozenset:
+    return frozenset(map(ref, samizdats))
+
 
 def gen_edges(samizdats: Iterable[Samizdat]):
     for sd in samizdats:
@@ -60,12 +71,20 @@ def subtree_nodes(samizdats: list[Samizdat], subtree_root):
     All nodes depending on subtree_root (includes subtree_root)
     """
 
-    def stn(subtree_root):
-        yield subtree_root
-        revdeps = (sd.fq() for sd in samizdats if (subtree_root in (sd.fqdeps_on() | sd.fqdeps_on_unmanaged())))
-        yield from chain.from_iterable(map(stn, revdeps))
+    revdeps: dict[FQTuple, list[FQTuple]] = {}
+    for sd in samizdats:
+        for dep in sd.fqdeps_on() | sd.fqdeps_on_unmanaged():
+            revdeps.setdefault(dep, []).append(sd.fq())
 
-    return set(stn(subtree_root))
+    # Iterative walk; each node is expanded once, however many paths lead to it
+    seen = {subtree_root}
+    todo = [subtree_root]
+    while todo:
+        for dependant in revdeps.get(todo.pop(), ()):
+            if dependant not in seen:
+                seen.add(dependant)
+                todo.append(dependant)
+    return seen
 
 
 def subtree_depends(samizdats: list[Samizdat], roots):
@@ -88,40 +107,74 @@ def subtree_depends(samizdats: list[Samizdat], roots):
     )
 
 
-def depsort(samizdats: Iterable[SamizType]):
+def depsort(samizdats: Iterable[SamizType]) -> tuple[SamizType, ...]:
     """
-    Topologically sort samizdats
+    Topologically sort samizdats (Kahn's algorithm)
     """
     samizdat_map = {sd.fq(): sd for sd in samizdats}
-    depmap = {sd.fq(): sd.fqdeps_on() for sd in samizdats}
-    toposorted = toposort(depmap)
-
-    return [samizdat_map[name] for name in chain(*toposorted)]
+    in_degree = dict.fromkeys(samizdat_map, 0)
+    dependants: dict[FQTuple, list[FQTuple]] = {fq: [] for fq in samizdat_map}
+    for fq, sd in samizdat_map.items():
+        for dep in sd.fqdeps_on():
+            if dep not in samizdat_map:
+                raise DanglingReferenceError(f"Nonexistent dependency referenced: {dep}", samizdat=sd)
+            dependants[dep].append(fq)
+            in_degree[fq] += 1
+
+    ready = deque(fq for fq, degree in in_degree.items() if not degree)
+    toposorted = []
+    while ready:
+        fq = ready.popleft()
+        toposorted.append(samizdat_map[fq])
+        for dependant in dependants[fq]:
+            in_degree[dependant] -= 1
+            if not in_degree[dependant]:
+                ready.append(dependant)
+
+    if len(toposorted) < len(samizdat_map):
+        # Whatever is left is either in a cycle or depends on one
+        cyclists = tuple(samizdat_map[fq] for fq, degree in in_degree.items() if degree)
+        raise DependencyCycleError("Dependency cycle detected", cyclists)
+    return tuple(toposorted)
 
 
-def depsort_with_sidekicks(samizdats: Iterable[SamizType]):
+def depsort_with_sidekicks(samizdats: Iterable[SamizType]) -> tuple[SamizType, ...]:
     """
     Injects "sidekicks" ino the topologically sorted
     samizdats list
     """
+    key = memo_key(samizdats)
+    if (cached := _sorted_memo.get(key)) is not None:
+        hits = tuple(sdref() for sdref in cached)
+        if None not in hits:
+            return hits
+
     returns: list[SamizType] = []
     heads = {sd.head_id() for sd in samizdats}
 
     for samizdat in depsort(samizdats):
         returns.append(samizdat)
         if hasattr(samizdat, "sidekicks"):
-            sd: SamizdatWithSidekicks = samizdat  # Declare the type for mypy
+            sd = cast(type[SamizdatWithSidekicks], samizdat)  # Declare the type for mypy
             for kick in sd.sidekicks():
                 if filter_sds(kick) and kick.head_id() not in heads:
                     returns.append(kick)
                     heads.add(kick.head_id())
-    return returns
+
+    if len(_sorted_memo) >= MEMO_MAXSIZE:
+        _sorted_memo.clear()
+    _sorted_memo[key] = tuple(map(ref, returns))
+    return tuple(returns)
 
 
 def sanity_check(samizdats: Iterable[SamizType]) -> Iterable[SamizType]:
     """
     Checks for a number of invalid conditions on the Samizdat tree
     """
+    key = memo_key(samizdats)
+    if key in _sane_memo:
+        return samizdats
+
     for sd in samizdats:
         # This raises an "UnsuitableNameError" if the
         # "name" is something Postgres might not handle well
@@ -146,11 +199,10 @@ def sanity_check(samizdats: Iterable[SamizType]) -> Iterable[SamizType]:
     if selfreffaulty := {sd for sd in samizdats if sd.fq() in sd.fqdeps_on()}:
         raise DependencyCycleError("Self-referential dependency", (selfreffaulty.pop(),))
 
-    # cycle detection - other levels; toposort will raise an exception if there's one
-    sdfqmap = {sd.fq(): sd for sd in samizdats}
-    try:
-        _ = depsort_with_sidekicks(samizdats)
-    except CircularDependencyError as ouch:
-        cyclists = tuple(map(sdfqmap.get, ouch.data.keys()))
-        raise DependencyCycleError("Dependency cycle detected", cyclists)
+    # cycle detection - other levels; depsort raises a DependencyCycleError if there's one
+    depsort_with_sidekicks(samizdats)
+
+    if len(_sane_memo) >= MEMO_MAXSIZE:
+        _sane_memo.clear()
+    _sane_memo.add(key)
     return samizdats
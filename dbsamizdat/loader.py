@@ -28,7 +28,7 @@ def filter_sds(inputklass: Any) -> TypeGuard[SamizType]:
     return inspect.isclass(inputklass) and issubclass(inputklass, subclasses_of) and inputklass not in subclasses_of
 
 
-def get_samizdats():
+def get_samizdats() -> frozenset[SamizType]:
     """
     Returns all subclasses of "Samizdat"
     where they are not considered abstract
@@ -43,7 +43,7 @@ def get_samizdats():
     unique: dict[str, SamizType] = {}
     for elem in all_subclasses():
         unique.setdefault(elem.definition_hash(), elem)
-    yield from unique.values()
+    return frozenset(unique.values())
 
 
 def samizdats_in_module(mod) -> SamizTypes:
@@ -2,19 +2,16 @@ import argparse
 import os
 import sys
 import typing
-from contextlib import contextmanager
+from contextlib import contextmanager, suppress
 from enum import Enum
 from importlib.util import find_spec
 from logging import getLogger
 from time import monotonic
 from typing import Generator, Iterable, Literal
 
-import dotenv
-
 from dbsamizdat.samizdat import Samizdat, SamizdatMaterializedView
 
 from .exceptions import DatabaseError, FunctionSignatureError, SamizdatException
-from .graphvizdot import dot
 from .libdb import dbinfo_to_class, dbstate_equals_definedstate, get_dbstate
 from .libgraph import depsort_with_sidekicks, node_dump, sanity_check, subtree_depends
 from .loader import SamizType, autodiscover_samizdats, get_samizdats
@@ -24,7 +21,12 @@ from .util import nodenamefmt, sqlfmt
 if typing.TYPE_CHECKING:
     from argparse import ArgumentParser
 
-dotenv.load_dotenv()
+try:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+except ModuleNotFoundError:
+    pass
 
 
 class txstyle(Enum):
@@ -34,6 +36,10 @@ class txstyle(Enum):
 
 
 ACTION = Literal["create", "nuke", "update", "refresh", "drop", "sign"]
+# Statements may or may not end in a semicolon; an empty statement in between is harmless
+BATCH_SEPARATOR = "\n;\n"
+# server_version_num from which CREATE OR REPLACE TRIGGER is available
+TRIGGER_REPLACE_VERSION = 140000
 
 logger = getLogger(__name__)
 PRINTKWARGS = dict(file=sys.stderr, flush=True)
@@ -47,6 +53,8 @@ class ArgType(argparse.Namespace):
     log_rather_than_print: bool = True
     dbconn: str = "default"
     dburl: str | None = os.environ.get("DBURL")
+    # An open psycopg[2] connection to use rather than connecting to `dburl`
+    connection: typing.Any = None
 
 
 def vprint(args: ArgType, *pargs, **pkwargs):
@@ -75,11 +83,11 @@ def get_sds(in_django: bool = False, samizdats: list[SamizType] | None = None):
      - A Django module search
     """
     if samizdats:
-        sds = set(samizdats)
+        sds = frozenset(samizdats)
     elif in_django:
-        sds = set(autodiscover_samizdats())
+        sds = frozenset(autodiscover_samizdats())
     else:
-        sds = set(get_samizdats())
+        sds = get_samizdats()
 
     sanity_check(sds)
     sorted_sds = list(depsort_with_sidekicks(sds))
@@ -90,35 +98,66 @@ def get_sds(in_django: bool = False, samizdats: list[SamizType] | None = None):
 @contextmanager
 def get_cursor(args: ArgType) -> Generator[Cursor, None, None]:
     """
-    Returns a psycopg or Django cursor
+    Returns a psycopg or Django cursor.
+    Connections opened here are closed again on the way out;
+    `args.connection` and Django's connections are left open for reuse.
     """
 
     dburl = getattr(args, "dburl", None)
+    conn = getattr(args, "connection", None)
+    opened = None
 
     if args.in_django:
         from django.db import connections
 
         cursor = connections[args.dbconn].cursor().cursor
 
+    elif conn is not None:
+        cursor = client_cursor(conn)
+
     elif dburl and find_spec("psycopg"):
         import psycopg  # noqa: F811
 
-        conn = psycopg.connect(dburl)
-        cursor = psycopg.ClientCursor(conn)
+        opened = psycopg.connect(dburl)
+        cursor = psycopg.ClientCursor(opened)
 
     elif dburl and find_spec("psycopg2"):
         import psycopg2
 
-        conn = psycopg2.connect(dburl)
-        cursor = conn.cursor()
+        opened = psycopg2.connect(dburl)
+        cursor = opened.cursor()
 
     else:
         raise NotImplementedError("Required: a Django project or psycopg[2] and a DB url")
 
-    cursor.execute("BEGIN;")
-    yield cursor
-    txi_finalize(cursor, getattr(args, "txdiscipline", "dryrun"))
-    cursor.close()
+    try:
+        cursor.execute("BEGIN;")
+        try:
+            yield cursor
+        except BaseException:
+            # Don't hand a reused connection back in an aborted transaction;
+            # if the connection itself is broken, the original error is the one to report
+            with suppress(Exception):
+                cursor.execute("ROLLBACK;")
+            raise
+        txi_finalize(cursor, getattr(args, "txdiscipline", "dryrun"))
+    finally:
+        cursor.close()
+        if opened is not None:
+            opened.close()
+
+
+def client_cursor(conn) -> Cursor:
+    """
+    A cursor on an existing psycopg or psycopg2 connection
+    which is able to `mogrify`
+    """
+    if find_spec("psycopg"):
+        import psycopg  # noqa: F811
+
+        if isinstance(conn, psycopg.Connection):
+            return typing.cast(Cursor, psycopg.ClientCursor(conn))
+    return conn.cursor()
 
 
 def txi_finalize(cursor: Cursor, txdiscipline: Literal["jumbo", "dryrun", "checkpoint"]):
@@ -137,9 +176,10 @@ def txi_finalize(cursor: Cursor, txdiscipline: Literal["jumbo", "dryrun", "check
 
 
 def cmd_refresh(args: ArgType):
+    # Invalid samizdats fail in get_sds, before we bother the database
+    samizdats = get_sds(args.in_django)
     with get_cursor(args) as cursor:
-        samizdats = get_sds(args.in_django)
-        matviews: list[SamizdatMaterializedView] = [sd for sd in samizdats if sd.entity_type == entitypes.MATVIEW]
+        matviews: list[SamizdatMaterializedView] = [sd for sd in samizdats if sd.entity_type is entitypes.MATVIEW]
 
         if args.belownodes:
             rootnodes = {FQTuple.fqify(rootnode) for rootnode in args.belownodes}
@@ -161,6 +201,24 @@ def cmd_refresh(args: ArgType):
         executor(refreshes(), args, cursor, max_namelen=max_namelen, timing=True)
 
 
+def replaceable_triggers(
+    cursor: Cursor, excess_dbstate: Iterable[SamizType], excess_definedstate: Iterable[SamizType]
+) -> set[FQTuple]:
+    """
+    Triggers which are being redefined, and which the server can replace in place
+    (CREATE OR REPLACE TRIGGER, PostgreSQL 14+) rather than drop and recreate
+    """
+    redefined = {sd.fq() for sd in excess_definedstate if sd.entity_type is entitypes.TRIGGER}
+    redefined &= {sd.fq() for sd in excess_dbstate if sd.entity_type is entitypes.TRIGGER}
+    if not redefined:
+        return set()
+    cursor.execute("SHOW server_version_num;")
+    row = cursor.fetchone()
+    if row is None or int(row[0]) < TRIGGER_REPLACE_VERSION:
+        return set()
+    return redefined
+
+
 def cmd_sync(args: ArgType, samizdatsIn: list[SamizType] | None = None):
     samizdats = tuple(get_sds(False, samizdatsIn)) or tuple(get_sds(args.in_django))
 
@@ -173,10 +231,12 @@ def cmd_sync(args: ArgType, samizdatsIn: list[SamizType] | None = None):
         # Get the longest name from what's in the
         # database and defined state
         max_namelen = max(len(str(ds)) for ds in db_compare.excess_dbstate | db_compare.excess_definedstate)
-        if db_compare.excess_dbstate:
+        to_replace = replaceable_triggers(cursor, db_compare.excess_dbstate, db_compare.excess_definedstate)
+        to_drop = {sd for sd in db_compare.excess_dbstate if sd.fq() not in to_replace}
+        if to_drop:
 
             def drops():
-                for sd in db_compare.excess_dbstate:
+                for sd in to_drop:
                     yield "drop", sd, sd.drop(if_exists=True)
                     # we don't know the deptree; so they may have vanished
                     # through a cascading drop of a previous object
@@ -193,13 +253,13 @@ def cmd_sync(args: ArgType, samizdatsIn: list[SamizType] | None = None):
                 for sd in samizdats:  # iterate in proper creation order
                     if sd.head_id() not in to_create_ids:
                         continue
-                    yield "create", sd, sd.create()
+                    yield "create", sd, sd.create_or_replace() if sd.fq() in to_replace else sd.create()
                     yield "sign", sd, sd.sign(cursor)
 
             executor(creates(), args, cursor, max_namelen=max_namelen, timing=True)
 
             matviews_to_refresh = {
-                sd.head_id() for sd in db_compare.excess_definedstate if sd.entity_type == entitypes.MATVIEW
+                sd.head_id() for sd in db_compare.excess_definedstate if sd.entity_type is entitypes.MATVIEW
             }
             if matviews_to_refresh:
 
@@ -212,8 +272,8 @@ def cmd_sync(args: ArgType, samizdatsIn: list[SamizType] | None = None):
 
 
 def cmd_diff(args: ArgType):
+    samizdats = get_sds(args.in_django)
     with get_cursor(args) as cursor:
-        samizdats = get_sds(args.in_django)
         db_compare = dbstate_equals_definedstate(cursor, samizdats)
         if db_compare.issame:
             vprint(args, "No differences.")
@@ -252,6 +312,8 @@ def cmd_diff(args: ArgType):
 
 
 def cmd_printdot(args: ArgType):
+    from .graphvizdot import dot
+
     print("\n".join(dot(get_sds(args.in_django))))
 
 
@@ -296,6 +358,24 @@ def executor(
             )
             vprint(args, f"\n\n{sqlfmt(sql)}\n\n")
 
+    if args.txdiscipline != txstyle.CHECKPOINT.value:
+        # Nothing is committed until the end anyway, so try all actions in one round trip.
+        # If that fails, roll back and replay them one by one to pin down the culprit.
+        actions = list(yielder)
+        if len(actions) > 1:
+            batch = BATCH_SEPARATOR.join(sql for _, _, sql in actions)
+            try:
+                cursor.execute(f"BEGIN;\nSAVEPOINT action_batch;\n{batch}")
+            except Exception:
+                cursor.execute("ROLLBACK TO SAVEPOINT action_batch;")
+            else:
+                cursor.execute("RELEASE SAVEPOINT action_batch;")
+                for progress in actions:
+                    progressprint(0, *progress)
+                vprint(args, "%.2fs" % next(action_timer) if timing else "")
+                return
+        yielder = actions
+
     action_cnt = 0
     for ix, progress in enumerate(yielder):
         action_cnt += 1
@@ -303,9 +383,8 @@ def executor(
         action_totake, sd, sql = progress
         try:
             try:
-                cursor.execute("BEGIN;")  # harmless if already in a tx but raises a warning
-                cursor.execute(f"SAVEPOINT action_{action_totake};")
-                cursor.execute(sql)
+                # One round trip: BEGIN is harmless if already in a tx but raises a warning
+                cursor.execute(f"BEGIN;\nSAVEPOINT action_{action_totake};\n{sql}")
             except Exception as ouch:
                 if action_totake == "sign":
                     cursor.execute(f"ROLLBACK TO SAVEPOINT action_{action_totake};")  # get back to a non-error state
@@ -316,11 +395,12 @@ def executor(
                 raise ouch
         except Exception as dberr:
             raise DatabaseError(f"{action_totake} failed", dberr, sd, sql)
-        cursor.execute(f"RELEASE SAVEPOINT action_{action_totake};")
+        release = f"RELEASE SAVEPOINT action_{action_totake};"
         if args.txdiscipline == txstyle.CHECKPOINT.value and action_totake != "create":
             # only commit *after* signing, otherwise if later the signing somehow fails
             # we'll have created an orphan DB object that we don't recognize as ours
-            cursor.execute("COMMIT;")
+            release += "\nCOMMIT;"
+        cursor.execute(release)
 
     if action_cnt:
         vprint(args, "%.2fs" % next(action_timer) if timing else "")
@@ -1,21 +1,77 @@
 from __future__ import annotations
 
+import os
 import typing
 from collections import Counter
-from hashlib import md5
+from functools import lru_cache
+from hashlib import blake2b, md5
 from json import dumps as jsondumps
 from string import Template
 from time import time as now
 
 from dbsamizdat.samtypes import FQTuple, HasRefreshTriggers, HasSidekicks, Mogrifier, ProtoSamizdat, entitypes
 
-from .util import nodenamefmt
+from .util import classcached, nodenamefmt
 
 _DBINFO_VERSION = 1  # Version number for signature format. For future use
 
 TRIGGER_DEPCOUNTER_PADDED_WIDTH = 5
 
 
+def definition_digest(*parts: str) -> str:
+    """
+    Hex digest of the "|"-joined parts.
+    Deployed databases are signed with MD5 definition hashes and switching algorithm recreates every samizdat,
+    so BLAKE2b is opt-in with DBSAMIZDAT_HASH=blake2b. That is read here rather than at import,
+    so a setting loaded from `.env` after importing dbsamizdat still applies.
+    Samizdats with a static template cache their hash on the class, so the setting must be
+    fixed before the first definition hash is computed; changing it later in the process has no effect on those.
+    """
+    return _digest(os.environ.get("DBSAMIZDAT_HASH") == "blake2b", parts)
+
+
+@lru_cache(maxsize=1024)
+def _digest(use_blake2b: bool, parts: tuple[str, ...]) -> str:
+    """
+    Memoized on the parts themselves, so a changed template never gets a stale hash
+    """
+    data = "|".join(parts).encode("utf-8")
+    if use_blake2b:
+        return blake2b(data, digest_size=16).hexdigest()
+    return md5(data, usedforsecurity=False).hexdigest()
+
+
+@lru_cache(maxsize=1024)
+def compile_template(template: str) -> tuple[tuple[str, str | None, str], ...]:
+    """
+    Split a `string.Template` into (literal, placeholder name, placeholder text)
+    chunks once, so rendering it is a join rather than a regex pass
+    """
+    chunks = []
+    start = 0
+    for match in Template.pattern.finditer(template):
+        end, next_start = match.span()
+        literal = template[start:end]
+        start = next_start
+        if (name := match.group("named") or match.group("braced")) is not None:
+            chunks.append((literal, name, match.group()))
+        elif match.group("escaped") is not None:
+            chunks.append((literal + Template.delimiter, None, ""))
+        else:  # invalid placeholders are left alone, as safe_substitute does
+            chunks.append((literal + match.group(), None, ""))
+    chunks.append((template[start:], None, ""))
+    return tuple(chunks)
+
+
+def substitute(template: str, **subst: str) -> str:
+    """
+    Same as `Template(template).safe_substitute(subst)`
+    """
+    return "".join(
+        literal + subst.get(name, text) if name else literal for literal, name, text in compile_template(template)
+    )
+
+
 class Samizdat(ProtoSamizdat):
     """
     Abstract parent class for dbsamizdat classes.
@@ -25,11 +81,19 @@ class Samizdat(ProtoSamizdat):
     # This is populated when restoring the class info from the database
     implanted_hash: str | None = None
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Parse static templates while the class is being defined, not on the first sync
+        if isinstance(template := cls.__dict__.get("sql_template"), str):
+            compile_template(template)
+
     @classmethod
+    @classcached
     def db_object_identity(cls):
         return cls.fq().db_object_identity()
 
     @classmethod
+    @classcached
     def fq(cls):
         return FQTuple(schema=cls.schema, object_name=cls.get_name())
 
@@ -46,16 +110,29 @@ class Samizdat(ProtoSamizdat):
         """
         if cls.implanted_hash:
             return cls.implanted_hash
+        if isinstance(cls.sql_template, str):
+            return cls.static_definition_hash()
+        # A callable template may render differently from one call to the next
+        return cls.compute_definition_hash()
 
-        return md5("|".join([cls.get_sql_template(), cls.db_object_identity()]).encode("utf-8")).hexdigest()
+    @classmethod
+    @classcached
+    def static_definition_hash(cls):
+        return cls.compute_definition_hash()
 
     @classmethod
+    def compute_definition_hash(cls):
+        return definition_digest(cls.get_sql_template(), cls.db_object_identity())
+
+    @classmethod
+    @classcached
     def fqdeps_on(cls):
-        return {FQTuple.fqify(dep) for dep in cls.deps_on}
+        return frozenset(FQTuple.fqify(dep) for dep in cls.deps_on)
 
     @classmethod
+    @classcached
     def fqdeps_on_unmanaged(cls):
-        return {FQTuple.fqify(dep) for dep in cls.deps_on_unmanaged}
+        return frozenset(FQTuple.fqify(dep) for dep in cls.deps_on_unmanaged)
 
     @classmethod
     def dbinfo(cls):
@@ -93,10 +170,10 @@ class Samizdat(ProtoSamizdat):
         """
         subst = dict(
             preamble=f"""CREATE {cls.entity_type.value} {cls.db_object_identity()} AS""",
-            postamble="WITH NO DATA" if cls.entity_type.name == "MATVIEW" else "",
+            postamble="WITH NO DATA" if cls.entity_type is entitypes.MATVIEW else "",
             samizdatname=cls.db_object_identity(),
         )
-        return Template(cls.get_sql_template()).safe_substitute(subst)
+        return substitute(cls.get_sql_template(), **subst)
 
     @classmethod
     def drop(cls, if_exists=False):
@@ -127,6 +204,7 @@ class SamizdatFunction(Samizdat):
         return getattr(cls, "function_name") or cls.__name__
 
     @classmethod
+    @classcached
     def fq(cls):
         return FQTuple(
             schema=cls.schema,
@@ -135,6 +213,7 @@ class SamizdatFunction(Samizdat):
         )
 
     @classmethod
+    @classcached
     def creation_identity(cls):
         return '"%s"."%s"(%s)' % (
             cls.schema,
@@ -143,18 +222,9 @@ class SamizdatFunction(Samizdat):
         )
 
     @classmethod
-    def definition_hash(cls):
-        """
-        Return the "implanted" hash if preset or generate
-        a new descriptive hash of this instance
-        """
-        if cls.implanted_hash:
-            return cls.implanted_hash
-
+    def compute_definition_hash(cls):
         # "Functions" adapt the hash to include creation options
-        return md5(
-            "|".join([cls.get_sql_template(), cls.db_object_identity(), cls.creation_identity()]).encode("utf-8")
-        ).hexdigest()
+        return definition_digest(cls.get_sql_template(), cls.db_object_identity(), cls.creation_identity())
 
     @classmethod
     def creation_function_arguments(cls) -> str:
@@ -166,7 +236,7 @@ class SamizdatFunction(Samizdat):
             preamble=f"CREATE {cls.entity_type.value} {cls.creation_identity()}",
             samizdatname=cls.db_object_identity(),
         )
-        return Template(cls.get_sql_template()).safe_substitute(subst)
+        return substitute(cls.get_sql_template(), **subst)
 
     @classmethod
     def head_id(cls):
@@ -184,6 +254,7 @@ class SamizdatTrigger(Samizdat):
     # through a materialized view with populated `refresh_triggers` attribute
 
     @classmethod
+    @classcached
     def fq(cls):
         """
         A trigger is not directly associated with a schema
@@ -194,27 +265,41 @@ class SamizdatTrigger(Samizdat):
         in the fully qualified name.
         """
 
-        return FQTuple(schema=FQTuple.fqify(cls.on_table).db_object_identity(), object_name=cls.get_name())
+        return FQTuple(schema=cls.on_table_fq().db_object_identity(), object_name=cls.get_name())
+
+    @classmethod
+    @classcached
+    def on_table_fq(cls) -> FQTuple:
+        return FQTuple.fqify(cls.on_table)
 
     def __str__(self):
         return nodenamefmt(self.fq())
 
     @classmethod
+    @classcached
     def fqdeps_on_unmanaged(cls):
-        return {FQTuple.fqify(n) for n in cls.deps_on_unmanaged | {cls.on_table}}
+        return frozenset(FQTuple.fqify(n) for n in cls.deps_on_unmanaged | {cls.on_table})
 
     @classmethod
-    def create(cls):
-        target_table = FQTuple.fqify(cls.on_table).db_object_identity()
+    def create(cls, or_replace=False):
+        target_table = cls.on_table_fq().db_object_identity()
+        verb = "CREATE OR REPLACE" if or_replace else "CREATE"
         subst = dict(
-            preamble=f"""CREATE {cls.entity_type.value} "{cls.get_name()}" {cls.condition} ON {target_table}""",
+            preamble=f"""{verb} {cls.entity_type.value} "{cls.get_name()}" {cls.condition} ON {target_table}""",
             samizdatname=cls.get_name(),
         )
-        return Template(cls.get_sql_template()).safe_substitute(subst)
+        return substitute(cls.get_sql_template(), **subst)
+
+    @classmethod
+    def create_or_replace(cls):
+        """
+        SQL to create this trigger, or redefine it in place (PostgreSQL 14+)
+        """
+        return cls.create(or_replace=True)
 
     @classmethod
     def drop(cls, if_exists=False):
-        ident = FQTuple.fqify(cls.on_table).db_object_identity()
+        ident = cls.on_table_fq().db_object_identity()
         return (
             f"""DROP {cls.entity_type.value} {"IF EXISTS" if if_exists else ""} {cls.get_name()} ON {ident} CASCADE;"""
         )
@@ -222,7 +307,7 @@ class SamizdatTrigger(Samizdat):
     @classmethod
     def sign(cls, cursor: Mogrifier):
         comment = cursor.mogrify(
-            f"""COMMENT ON {cls.entity_type.value} "{cls.get_name()}" ON {FQTuple.fqify(cls.on_table).db_object_identity()} IS %s;""",
+            f"""COMMENT ON {cls.entity_type.value} "{cls.get_name()}" ON {cls.on_table_fq().db_object_identity()} IS %s;""",
             (cls.dbinfo(),),
         )
         if isinstance(comment, bytes):
@@ -233,10 +318,10 @@ class SamizdatTrigger(Samizdat):
     def head_id(cls):
         return hash(
             (
-                FQTuple.fqify(cls.on_table).schema,
+                cls.on_table_fq().schema,
                 cls.get_name(),
                 cls.entity_type.name,
-                FQTuple.fqify(cls.on_table).object_name,
+                cls.on_table_fq().object_name,
                 cls.definition_hash(),
             )
         )
@@ -4,6 +4,7 @@ from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
 from typing import Any, Callable, Iterable, Type
+from weakref import WeakValueDictionary
 
 from dbsamizdat.exceptions import UnsuitableNameError
 
@@ -52,6 +53,20 @@ class FQTuple:
     object_name: str | None = None
     args: str | None = None
 
+    def __new__(cls, schema: str | None = "public", object_name: str | None = None, args: str | None = None):
+        """
+        Equal FQTuples are interned as one object (while any of them is alive),
+        so set and dict lookups mostly succeed on identity
+        """
+        key = (cls, schema, object_name, args)
+        if (interned := _interned_fqtuples.get(key)) is None:
+            interned = _interned_fqtuples[key] = super().__new__(cls)
+        return interned
+
+    def __reduce__(self):
+        # copy and pickle must go through __new__ with the values, not patch an interned instance
+        return (type(self), (self.schema, self.object_name, self.args))
+
     def __lt__(self, other: FQTuple):
         return self.db_object_identity() > other.db_object_identity()
 
@@ -94,6 +109,8 @@ class FQTuple:
             raise TypeError
 
 
+_interned_fqtuples: WeakValueDictionary[tuple, FQTuple] = WeakValueDictionary()
+
 objectname = str
 schemaname = str
 sql_query = str
@@ -209,12 +226,12 @@ class ProtoSamizdat(HasFQ, HasGetName, SqlGeneration):
 
     @classmethod
     @abstractmethod
-    def fqdeps_on(cls) -> set[FQTuple]:
+    def fqdeps_on(cls) -> frozenset[FQTuple]:
         ...
 
     @classmethod
     @abstractmethod
-    def fqdeps_on_unmanaged(cls) -> set[FQTuple]:
+    def fqdeps_on_unmanaged(cls) -> frozenset[FQTuple]:
         ...
 
     @classmethod
@@ -273,6 +290,10 @@ class Cursor(Mogrifier):
     def close(self) -> None:
         ...
 
+    @abstractmethod
+    def fetchone(self) -> tuple | None:
+        ...
+
     @abstractmethod
     def fetchall(self) -> list:
         ...
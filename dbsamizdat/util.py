@@ -1,3 +1,8 @@
+from functools import wraps
+
+from dbsamizdat.samtypes import FQTuple
+
+
 def nodenamefmt(node) -> str:
     """
     format node for presentation purposes. If it's in the public schema,
@@ -6,13 +11,32 @@ def nodenamefmt(node) -> str:
     if isinstance(node, str):
         return node
     if isinstance(node, tuple):
-        schema, name, *args = node
-        identifier = f"{schema}.{name}" if schema not in {"public", None} else name
-        if args and args[0]:
-            return f"{identifier}({args[0]})"
-        return identifier
-    return str(node)  # then it should be a Samizdat
+        schema, name, *rest = node
+        args = rest[0] if rest else None
+    elif isinstance(node, FQTuple):
+        schema, name, args = node.schema, node.object_name, node.args
+    else:
+        return str(node)  # then it should be a Samizdat
+    identifier = name if schema in {"public", None} else f"{schema}.{name}"
+    return f"{identifier}({args})" if args else identifier
 
 
 def sqlfmt(sql: str):
     return "\n".join(("\t\t" + line for line in sql.splitlines()))
+
+
+def classcached(fn):
+    """
+    Decorator for argument-less classmethods whose result only depends on
+    class attributes. The result is stored on the class it was computed for;
+    subclasses never see their parent's value.
+    """
+    attrname = f"_cached_{fn.__name__}"
+
+    @wraps(fn)
+    def wrapper(cls):
+        if attrname not in cls.__dict__:
+            setattr(cls, attrname, fn(cls))
+        return cls.__dict__[attrname]
+
+    return wrapper
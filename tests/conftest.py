@@ -0,0 +1,127 @@
+import gc
+import os
+from importlib.util import find_spec
+
+import pytest
+
+from dbsamizdat.libgraph import depsort_with_sidekicks, sanity_check
+from dbsamizdat.loader import get_samizdats
+from dbsamizdat.runner import ArgType, cmd_nuke
+
+if not os.environ.get("DBURL"):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+DBURL = os.environ.get("DBURL", "postgresql://postgres@localhost:5435/postgres")
+
+
+def parse_dsn(dsn: str) -> dict:
+    """
+    Parse a URI or keyword/value connection string with whichever driver is installed
+    """
+    if find_spec("psycopg"):
+        from psycopg.conninfo import conninfo_to_dict
+
+        return conninfo_to_dict(dsn)
+    from psycopg2.extensions import parse_dsn as psycopg2_parse_dsn
+
+    return psycopg2_parse_dsn(dsn)
+
+
+def make_dsn(dsn: str, **kwargs: str) -> str:
+    """
+    `dsn` with `kwargs` replacing its parameters, with whichever driver is installed
+    """
+    if find_spec("psycopg"):
+        from psycopg.conninfo import make_conninfo
+
+        return make_conninfo(dsn, **kwargs)
+    from psycopg2.extensions import make_dsn as psycopg2_make_dsn
+
+    return psycopg2_make_dsn(dsn, **kwargs)
+
+
+def worker_dbname(worker: str) -> str:
+    dbname = parse_dsn(DBURL).get("dbname") or "postgres"
+    return f"{dbname}_{worker}"
+
+
+def worker_dburl(worker: str | None) -> str:
+    """
+    Under pytest-xdist every worker gets a database of its own,
+    so workers can sync and nuke without stepping on each other
+    """
+    if not worker:
+        return DBURL
+    return make_dsn(DBURL, dbname=worker_dbname(worker))
+
+
+def connect(dburl: str):
+    if find_spec("psycopg"):
+        import psycopg
+
+        return psycopg.connect(dburl)
+    import psycopg2
+
+    return psycopg2.connect(dburl)
+
+
+def create_worker_database(worker: str):
+    dbname = worker_dbname(worker)
+    conn = connect(DBURL)
+    conn.autocommit = True
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (dbname,))
+        if not cursor.fetchone():
+            quoted = dbname.replace('"', '""')
+            cursor.execute(f'CREATE DATABASE "{quoted}" TEMPLATE template0')
+    finally:
+        conn.close()
+
+
+@pytest.fixture(scope="session")
+def db_connection():
+    """
+    One connection for the whole session, instead of one per `get_cursor`.
+    Nothing connects before a test asks for this, so `pytest -m unit` runs without a database.
+    """
+    if worker := os.environ.get("PYTEST_XDIST_WORKER"):
+        create_worker_database(worker)
+    conn = connect(worker_dburl(worker))
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope="session")
+def db_args(db_connection):
+    return ArgType(
+        txdiscipline="jumbo",
+        verbosity=3,
+        dburl=worker_dburl(os.environ.get("PYTEST_XDIST_WORKER")),
+        connection=db_connection,
+    )
+
+
+@pytest.fixture
+def clean_db(db_args):
+    """
+    Database args for a database without samizdats.
+    It is nuked before every test, so no test depends on what an earlier one left behind.
+    """
+    cmd_nuke(db_args)
+    # Nuking reconstructs classes for what it found in the database; those are
+    # discoverable through `__subclasses__` until they're collected
+    gc.collect()
+    return db_args
+
+
+@pytest.fixture(scope="session")
+def discovered_samizdats():
+    """
+    Every samizdat defined at import time, checked and sorted once per session.
+    Discovery goes through `__subclasses__`, so this is deliberately not cached
+    in the library: classes defined later must still be found there.
+    """
+    return depsort_with_sidekicks(sanity_check(get_samizdats()))
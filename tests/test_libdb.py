@@ -0,0 +1,55 @@
+import gc
+from json import dumps as jsondumps
+from weakref import ref
+
+import pytest
+
+from dbsamizdat.libdb import StateTuple, dbinfo_to_class
+from dbsamizdat.samizdat import SamizdatFunction
+from dbsamizdat.samtypes import FQTuple
+
+pytestmark = pytest.mark.unit
+
+
+def make_state(
+    definition_hash: str | None = "abc123",
+    viewname: str = "test_view",
+    objecttype: str = "VIEW",
+    args: str | None = None,
+) -> StateTuple:
+    """
+    A row as `get_dbstate` would return it, comment included
+    """
+    comment = jsondumps(dict(dbsamizdat=dict(version=1, created=0, definition_hash=definition_hash)))
+    return StateTuple("public", viewname, objecttype, comment, args, definition_hash)
+
+
+def test_dbinfo_to_class_reuses_classes():
+    info = make_state(viewname="Doubler", objecttype="FUNCTION", args="x integer")
+    klass = dbinfo_to_class(info)
+    assert issubclass(klass, SamizdatFunction)
+    assert klass.fq() is FQTuple("public", "Doubler", "x integer")
+    assert klass.definition_hash() == "abc123"
+
+    # The comment (with its timestamp) does not matter; the hash does
+    assert dbinfo_to_class(info._replace(commentcontent="{ }")) is klass
+    assert dbinfo_to_class(info._replace(definition_hash="def456")) is not klass
+
+    # Nothing keeps reconstructed classes around for `get_samizdats` to find
+    witness = ref(klass)
+    del klass
+    gc.collect()
+    assert witness() is None
+
+
+@pytest.mark.parametrize(
+    "definition_hash,expected",
+    [
+        pytest.param("implanted_hash_value", "implanted_hash_value", id="valid"),
+        pytest.param(None, "None", id="none"),
+    ],
+)
+def test_reconstructed_definition_hash(definition_hash, expected):
+    reconstructed = dbinfo_to_class(make_state(definition_hash))
+    assert reconstructed.definition_hash() == expected
+    assert reconstructed.head_id() == hash(("public", "test_view", "VIEW", expected))
@@ -0,0 +1,68 @@
+import gc
+from weakref import ref
+
+import pytest
+
+from dbsamizdat.libgraph import depsort_with_sidekicks, sanity_check, subtree_depends, subtree_nodes
+from dbsamizdat.samizdat import SamizdatView
+from dbsamizdat.samtypes import FQTuple
+
+pytestmark = pytest.mark.unit
+
+
+def test_sort_is_memoized_without_keeping_samizdats_alive():
+    class MemoOne(SamizdatView):
+        sql_template = "${preamble} SELECT 1 ${postamble}"
+
+    class MemoTwo(SamizdatView):
+        deps_on = {MemoOne}
+        sql_template = """${preamble} SELECT * FROM "MemoOne" ${postamble}"""
+
+    samizdats = {MemoTwo, MemoOne}
+    assert sanity_check(samizdats) is samizdats
+    assert depsort_with_sidekicks(samizdats) == (MemoOne, MemoTwo)
+    assert depsort_with_sidekicks(list(samizdats)) == (MemoOne, MemoTwo)
+
+    # The memo must not keep these discoverable for later `get_samizdats` calls
+    witness = ref(MemoTwo)
+    del MemoOne, MemoTwo, samizdats
+    gc.collect()
+    assert witness() is None
+
+
+def test_subtree_of_a_deep_chain():
+    """
+    Deeper than the recursion limit, and every node reachable along two paths
+    """
+    depth = 2000
+    chain = [type("Link0", (SamizdatView,), dict(deps_on_unmanaged={"Fruit"}, sql_template=""))]
+    for ix in range(1, depth):
+        deps = set(chain[-2:])
+        chain.append(type(f"Link{ix}", (SamizdatView,), dict(deps_on=deps, sql_template="")))
+
+    assert subtree_nodes(chain, FQTuple.fqify("Fruit")) == {FQTuple.fqify("Fruit")} | {sd.fq() for sd in chain}
+    assert subtree_depends(chain, {chain[-2].fq()}) == set(chain[-2:])
+
+    del chain, deps
+    gc.collect()
+
+
+@pytest.mark.parametrize("width", [1, 2, 50])
+def test_depsort_diamond(width):
+    """
+    One root, `width` branches on it, and a join on all branches
+    """
+    template = "${preamble} SELECT 1 ${postamble}"
+    root = type("Root", (SamizdatView,), dict(sql_template=template))
+    branches = [
+        type(f"Branch{ix}", (SamizdatView,), dict(deps_on={root}, sql_template=template)) for ix in range(width)
+    ]
+    join = type("Join", (SamizdatView,), dict(deps_on=set(branches), sql_template=template))
+
+    toposorted = depsort_with_sidekicks([join, *reversed(branches), root])
+    assert toposorted[0] is root
+    assert toposorted[-1] is join
+    assert set(toposorted[1:-1]) == set(branches)
+
+    del root, branches, join, toposorted
+    gc.collect()
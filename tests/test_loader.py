@@ -1,8 +1,12 @@
 from importlib import import_module
 
+import pytest
+
 from dbsamizdat.loader import samizdats_in_app, samizdats_in_module
 from sample_app.dbsamizdat_defs import AView
 
+pytestmark = pytest.mark.unit
+
 
 def test_load_from_module():
     m = import_module("sample_app.test_samizdats")
@@ -0,0 +1,219 @@
+import copy
+import gc
+import os
+import re
+import subprocess
+import sys
+from functools import cache
+from hashlib import blake2b, md5
+from string import Template
+
+import pytest
+
+from dbsamizdat.samizdat import SamizdatView, definition_digest, substitute
+from dbsamizdat.samtypes import FQTuple
+from sample_app.test_samizdats import DealFruitFun, DealFruitFunWithName, DealFruitView, FruitCensor, PetUppercase
+
+pytestmark = pytest.mark.unit
+
+
+@cache
+def render(samizdat) -> str:
+    """
+    The sample app's classes are module-level and their templates static,
+    so each is rendered once for all tests here
+    """
+    return samizdat.create()
+
+
+PREAMBLE_MARKER = "${preamble}"
+POSTAMBLE_MARKER = "${postamble}"
+SAMIZDATNAME_MARKER = "${samizdatname}"
+WITH_NO_DATA = "WITH NO DATA"
+
+PREAMBLE_CASES = [
+    pytest.param(DealFruitView, 'CREATE VIEW "public"."DealFruitView" AS', False, id="view"),
+    pytest.param(PetUppercase, 'CREATE MATERIALIZED VIEW "public"."PetUppercase" AS', True, id="matview"),
+    pytest.param(DealFruitFun, 'CREATE FUNCTION "public"."DealFruitFun"()', False, id="function"),
+    pytest.param(FruitCensor, 'CREATE TRIGGER "FruitCensor" BEFORE INSERT', False, id="trigger"),
+]
+
+
+@pytest.mark.parametrize(
+    "template",
+    [
+        "${preamble} SELECT 1 ${postamble}",
+        "$preamble SELECT 1;\nCREATE INDEX ON ${samizdatname} (id)",
+        "${preamble} RETURNS text AS $BODY$ SELECT '$$' $BODY$",
+        "${preamble} SELECT '${undefined}', '$', '${' ${postamble}",
+        "no placeholders at all",
+        "",
+    ],
+)
+def test_substitute_matches_safe_substitute(template):
+    subst = dict(preamble="CREATE VIEW x AS", postamble="", samizdatname='"public"."x"')
+    assert substitute(template, **subst) == Template(template).safe_substitute(subst)
+
+
+def test_fqtuples_are_interned():
+    fq = FQTuple("public", "Fruit")
+    assert FQTuple(schema="public", object_name="Fruit") is fq
+    assert FQTuple.fqify("Fruit") is fq
+    assert FQTuple("public", "Fruit", "name text") is not fq
+    # copying must not hand out (or clobber) a different interned instance
+    assert copy.copy(fq) is fq
+    assert copy.deepcopy(FQTuple("public", "Pet")) == FQTuple("public", "Pet")
+    assert FQTuple() == FQTuple("public", None, None)
+
+
+@pytest.mark.parametrize(
+    "samizdat,expected_create,expected_drop",
+    [
+        (
+            DealFruitView,
+            ['CREATE VIEW "public"."DealFruitView" AS', 'FROM "public"."Fruit"'],
+            ['DROP VIEW  "public"."DealFruitView" CASCADE;'],
+        ),
+        (
+            PetUppercase,
+            [
+                'CREATE MATERIALIZED VIEW "public"."PetUppercase" AS',
+                f"{WITH_NO_DATA};",
+                'CREATE UNIQUE INDEX ON "public"."PetUppercase" (id);',
+            ],
+            ['DROP MATERIALIZED VIEW  "public"."PetUppercase" CASCADE;'],
+        ),
+        (
+            DealFruitFunWithName,
+            ['CREATE FUNCTION "public"."DealFruitFun"(name text)', "RETURNS text AS", "$BODY$"],
+            ['DROP FUNCTION  "public"."DealFruitFun"(name text) CASCADE;'],
+        ),
+        (
+            FruitCensor,
+            ['CREATE TRIGGER "FruitCensor" BEFORE INSERT OR UPDATE OF name ON "public"."Fruit"', "FOR EACH ROW"],
+            ['ON "public"."Fruit" CASCADE;'],
+        ),
+    ],
+)
+def test_sql_generation(samizdat, expected_create, expected_drop):
+    # One scan per statement for all expected fragments
+    create_pattern = re.compile("|".join(map(re.escape, expected_create)))
+    drop_pattern = re.compile("|".join(map(re.escape, expected_drop)))
+    create_sql = render(samizdat)
+    assert set(create_pattern.findall(create_sql)) == set(expected_create)
+    assert set(drop_pattern.findall(samizdat.drop())) == set(expected_drop)
+    assert "${" not in create_sql
+
+
+def test_trigger_create_or_replace():
+    replace_sql = FruitCensor.create_or_replace()
+    assert replace_sql.lstrip().startswith('CREATE OR REPLACE TRIGGER "FruitCensor" BEFORE INSERT')
+    assert replace_sql == render(FruitCensor).replace("CREATE", "CREATE OR REPLACE", 1)
+
+
+@pytest.mark.parametrize("samizdat,preamble,with_no_data", PREAMBLE_CASES)
+def test_template_variables(samizdat, preamble, with_no_data):
+    create_sql = render(samizdat)
+    assert create_sql.lstrip().startswith(preamble)
+    assert (WITH_NO_DATA in create_sql) is with_no_data
+
+
+@pytest.mark.parametrize("marker", [PREAMBLE_MARKER, POSTAMBLE_MARKER, SAMIZDATNAME_MARKER])
+@pytest.mark.parametrize("samizdat", [case.values[0] for case in PREAMBLE_CASES], ids=lambda sd: sd.__name__)
+def test_template_variables_substituted(samizdat, marker):
+    """
+    Every template variable is substituted for every samizdat type
+    """
+    assert marker not in render(samizdat)
+
+
+def test_samizdatname_variable():
+    assert 'CREATE UNIQUE INDEX ON "public"."PetUppercase" (id);' in render(PetUppercase)
+
+
+def test_definition_hash_caching():
+    class Static(SamizdatView):
+        sql_template = "${preamble} SELECT 1 ${postamble}"
+
+    class Renamed(Static):
+        object_name = "Renamed"
+
+    class Dynamic(SamizdatView):
+        number = 1
+
+        @classmethod
+        def sql_template(cls):
+            return f"${{preamble}} SELECT {cls.number} ${{postamble}}"
+
+    assert Static.definition_hash() == Static.definition_hash()
+    # a subclass never picks up its parent's cached hash
+    assert Renamed.definition_hash() != Static.definition_hash()
+
+    before = Dynamic.definition_hash()
+    Dynamic.number = 2
+    assert Dynamic.definition_hash() != before
+
+    # keep them from being discovered by later `get_samizdats` calls
+    del Static, Renamed, Dynamic
+    gc.collect()
+
+
+@pytest.mark.parametrize("setting,is_md5", [(None, True), ("md5", True), ("blake2b", False)])
+def test_definition_digest(monkeypatch, setting, is_md5):
+    if setting is None:
+        monkeypatch.delenv("DBSAMIZDAT_HASH", raising=False)
+    else:
+        monkeypatch.setenv("DBSAMIZDAT_HASH", setting)
+    digest = definition_digest("SELECT 1", '"public"."x"')
+    assert len(digest) == 32
+    # MD5 by default, matching what existing databases are signed with
+    assert (digest == md5(b'SELECT 1|"public"."x"').hexdigest()) is is_md5
+
+
+@pytest.mark.parametrize("dburl", [None, "postgresql://postgres@localhost:5435/postgres"], ids=["no-dburl", "dburl"])
+def test_hash_setting_from_dotenv(tmp_path, dburl):
+    """
+    The runner loads `.env` after dbsamizdat.samizdat is imported, whether or not DBURL
+    is exported; a DBSAMIZDAT_HASH from `.env` must still apply.
+    Runs in a fresh interpreter, as that is where the runner's import-time loading happens.
+    """
+    dotenv = tmp_path / ".env"
+    dotenv.write_text("DBSAMIZDAT_HASH=blake2b\n")
+    script = f"""
+import dotenv.main
+dotenv.main.find_dotenv = lambda *args, **kwargs: {str(dotenv)!r}
+import dbsamizdat.runner
+from dbsamizdat.samizdat import definition_digest
+print(definition_digest("SELECT 1"))
+"""
+    env = {k: v for k, v in os.environ.items() if k not in {"DBSAMIZDAT_HASH", "DBURL"}}
+    if dburl:
+        env["DBURL"] = dburl
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == blake2b(b"SELECT 1", digest_size=16).hexdigest()
+
+
+@pytest.mark.parametrize(
+    "implanted,expected",
+    [
+        pytest.param("custom_hash_value", "custom_hash_value", id="valid"),
+        pytest.param("", None, id="empty"),
+        pytest.param(None, None, id="none"),
+    ],
+)
+def test_implanted_hash(implanted, expected):
+    """
+    An implanted hash wins over the computed one, unless it's empty
+    """
+    # A throwaway subclass rather than patching DealFruitView, whose cached hash other tests share
+    implanted_view = type("ImplantedView", (DealFruitView,), dict(implanted_hash=implanted))
+    assert implanted_view.definition_hash() == (expected or implanted_view.compute_definition_hash())
+
+    del implanted_view
+    gc.collect()
+
+
+def test_creation_identity():
+    assert DealFruitFun.creation_identity() == '"public"."DealFruitFun"()'
+    assert DealFruitFunWithName.creation_identity() == '"public"."DealFruitFun"(name text)'
+    assert DealFruitFunWithName.creation_identity() is DealFruitFunWithName.creation_identity()
@@ -1,24 +1,16 @@
 # content of test_sample.py
-import os
+import gc
+from contextlib import nullcontext
 
 import pytest
-from dotenv import load_dotenv
 
-from dbsamizdat.exceptions import DependencyCycleError, NameClashError, UnsuitableNameError
-from dbsamizdat.graphvizdot import dot
+from dbsamizdat.exceptions import DatabaseError, DependencyCycleError, NameClashError, UnsuitableNameError
 from dbsamizdat.libdb import dbinfo_to_class, dbstate_equals_definedstate, get_dbstate
 from dbsamizdat.libgraph import depsort_with_sidekicks, sanity_check
-from dbsamizdat.loader import get_samizdats
 from dbsamizdat.runner import ArgType, cmd_nuke, cmd_sync, get_cursor
-from dbsamizdat.samizdat import SamizdatMaterializedView, SamizdatView
-from dbsamizdat.samtypes import FQTuple
-from sample_app.test_samizdats import DealFruitFun, DealFruitFunWithName
-
-load_dotenv()
-args = ArgType(
-    txdiscipline="jumbo", verbosity=3, dburl=os.environ.get("DBURL", "postgresql://postgres@localhost:5435/postgres")
-)
-
+from dbsamizdat.samizdat import SamizdatMaterializedView, SamizdatTrigger, SamizdatView
+from dbsamizdat.samtypes import FQTuple, entitypes
+from sample_app.test_samizdats import DealFruitFun, DealFruitFunWithName, FruitCensor, Raise
 
 fruittable_SQL = """
     CREATE TABLE IF NOT EXISTS "Fruit" (
@@ -77,7 +69,34 @@ class MaterializedThing(SamizdatMaterializedView):
     """
 
 
-def test_code_generation():
+def probe_sql(samizdat) -> str:
+    """
+    Fails unless the samizdat's relation exists, without fetching any rows
+    """
+    return f"SELECT 1 FROM {samizdat.db_object_identity()} LIMIT 0;"
+
+
+def catalog_snapshot(args) -> dict[str, set[str]]:
+    """
+    Names of the signed objects in the database per object type, in a single query
+    """
+    snapshot: dict[str, set[str]] = {}
+    with get_cursor(args) as cursor:
+        for state in get_dbstate(cursor):
+            snapshot.setdefault(state.objecttype, set()).add(state.viewname)
+    return snapshot
+
+
+def pipelined(cursor):
+    """
+    psycopg 3 sends the statements queued in a pipeline without waiting for each result.
+    psycopg2 has no pipeline mode; there they simply run one by one.
+    """
+    pipeline = getattr(cursor.connection, "pipeline", None)
+    return pipeline() if pipeline else nullcontext()
+
+
+def test_code_generation(db_args):
     """
     Assert that code generation raises no errors
     """
@@ -97,7 +116,7 @@ def test_code_generation():
     AnotherThing.fqdeps_on_unmanaged()
     AnotherThing.dbinfo()
     # These SQL-generating functions require a cursor
-    with get_cursor(args) as cursor:
+    with get_cursor(db_args) as cursor:
         AnotherThing.sign(cursor)
 
     AnotherThing.create()
@@ -113,7 +132,7 @@ def test_code_generation():
     assert DealFruitFunWithName.fq() == FQTuple("public", "DealFruitFun", "name text")
     assert MaterializedThing.fqdeps_on() == {FQTuple("public", "AnotherThing")}
 
-    with get_cursor(args) as cursor:
+    with get_cursor(db_args) as cursor:
         assert DealFruitFunWithName.sign(cursor) != DealFruitFun.sign(cursor)
     # "Sidekicks" generates
     MaterializedThing.sidekicks()
@@ -122,47 +141,61 @@ def test_code_generation():
     # A materialized view
 
 
-def test_create_view():
-    cmd_nuke(args)
-    # What are the dependencies of `MaterializedThing`?
-    with get_cursor(args) as cursor:
+@pytest.fixture(scope="session")
+def fruit_pet_tables(db_args):
+    """
+    The unmanaged tables the sample app's samizdats depend on, created once per session
+    """
+    with get_cursor(db_args) as cursor:
         cursor.execute(fruittable_SQL)
+    return db_args
 
-    cmd_sync(args)
 
-    with get_cursor(args) as cursor:
-        cursor.execute(f"SELECT * FROM {AnotherThing.db_object_identity()};")
-        cursor.fetchall()
+def test_create_view(clean_db, fruit_pet_tables, discovered_samizdats):
+    cmd_sync(clean_db)
 
     # All dbszmizdats should be registered now
 
-    samizdats = tuple(depsort_with_sidekicks(sanity_check(set(get_samizdats()))))
+    samizdats = discovered_samizdats
 
-    dot(samizdats)
+    with get_cursor(clean_db) as cursor, pipelined(cursor):
+        for sd in samizdats:
+            if sd.entity_type in (entitypes.VIEW, entitypes.MATVIEW):
+                cursor.execute(probe_sql(sd))
 
-    with get_cursor(args) as cursor:
-        current_state = get_dbstate(cursor)
-        (dbinfo_to_class(s) for s in current_state)
-        get_dbstate(cursor)
+    from dbsamizdat.graphvizdot import dot
+
+    dotfile = "\n".join(dot(samizdats))
+    assert dotfile.lstrip().startswith("digraph {")
+    # every samizdat gets a node, except autogenerated refreshers which are drawn as edges
+    for sd in samizdats:
+        if not getattr(sd, "autorefresher", False):
+            assert f'"{sd}" [shape=' in dotfile
+
+    with get_cursor(clean_db) as cursor:
+        current_state = list(get_dbstate(cursor))
+        for s in current_state:
+            dbinfo_to_class(s)
         # We've just done a sync so dbstate should equal defined state
-        assert dbstate_equals_definedstate(cursor, samizdats).issame
+        assert dbstate_equals_definedstate(cursor, samizdats, current_state).issame
 
-    cmd_sync(args)
-    with get_cursor(args) as cursor:
+    cmd_sync(clean_db)
+    with get_cursor(clean_db) as cursor:
         assert DealFruitFunWithName.sign(cursor) != DealFruitFun.sign(cursor)
         cursor.execute(
             f"""
             SELECT "{DealFruitFunWithName.get_name()}"(name) AS treat FROM "public"."Pet"
         """
         )
-    cmd_nuke(args)
-    with get_cursor(args) as cursor:
+    cmd_nuke(clean_db)
+    with get_cursor(clean_db) as cursor:
         # Now we expect this to raise an error
         with pytest.raises(Exception):
-            cursor.execute(f"SELECT * FROM {AnotherThing.db_object_identity()};")
+            cursor.execute(probe_sql(AnotherThing))
             cursor.fetchall()
 
 
+@pytest.mark.unit
 def test_long_name_raises():
     """
     Samizdats with 'broken' names are not allowed
@@ -176,11 +209,11 @@ def test_long_name_raises():
             ${postamble}
         """
 
-    cmd_nuke(args)
     with pytest.raises(UnsuitableNameError):
-        cmd_sync(args, [LongNamedSamizdat])
+        sanity_check({LongNamedSamizdat})
 
 
+@pytest.mark.unit
 def test_unsuitable_name_raises():
     class BadlyNamedSamizdat(SamizdatView):
         object_name = '"hello"'
@@ -190,11 +223,11 @@ def test_unsuitable_name_raises():
             ${postamble}
         """
 
-    cmd_nuke(args)
     with pytest.raises(UnsuitableNameError):
-        cmd_sync(args, [BadlyNamedSamizdat])
+        sanity_check({BadlyNamedSamizdat})
 
 
+@pytest.mark.unit
 def test_duplicate_name_raises():
     class IAmCalledHello(SamizdatView):
         object_name = "hello"
@@ -212,11 +245,11 @@ def test_duplicate_name_raises():
             ${postamble}
         """
 
-    cmd_nuke(args)
     with pytest.raises(NameClashError):
-        cmd_sync(args, [IAmCalledHello, IAmCalledHelloToo])
+        sanity_check({IAmCalledHello, IAmCalledHelloToo})
 
 
+@pytest.mark.unit
 def test_cyclic_exception():
     class helloWorld(SamizdatView):
         deps_on = {"hello2"}
@@ -236,11 +269,11 @@ def test_cyclic_exception():
             ${postamble}
         """
 
-    cmd_nuke(args)
     with pytest.raises(DependencyCycleError):
-        cmd_sync(args, [helloWorld, helloWorldAgain])
+        sanity_check({helloWorld, helloWorldAgain})
 
 
+@pytest.mark.unit
 def test_self_reference_raises():
     """
     A Samizdat may not refer to itself as a dependency
@@ -255,19 +288,16 @@ def test_self_reference_raises():
             ${postamble}
         """
 
-    cmd_nuke(args)
     with pytest.raises(DependencyCycleError):
-        cmd_sync(args, [hello])
+        sanity_check({hello})
 
 
-def test_sidekicks():
+def test_sidekicks(clean_db):
     """
     This test ensures that a materialized view
     with "refresh triggers" watches for changes
     """
 
-    cmd_nuke(args)
-
     class Treater(SamizdatMaterializedView):
         deps_on_unmanaged = {"d", "d2"}
         refresh_triggers = {"d", "d2"}
@@ -281,41 +311,41 @@ def test_sidekicks():
     # This should be one 'refresh' and two 'triggers'
     assert len(depsort_with_sidekicks([Treater])) == 4
 
-    with get_cursor(args) as c:
-        c.execute("DROP TABLE IF EXISTS d CASCADE;")
-        c.execute("DROP TABLE IF EXISTS d2 CASCADE;")
-        c.execute("CREATE TABLE IF NOT EXISTS d AS SELECT now() n;")
-        c.execute("COMMIT;")
-        c.execute("CREATE TABLE IF NOT EXISTS d2 AS SELECT now() n;")
-        c.execute("COMMIT;")
+    with get_cursor(clean_db) as c:
+        # One round trip. The tables are committed separately so their now()s differ
+        c.execute(
+            """
+            DROP TABLE IF EXISTS d, d2 CASCADE;
+            CREATE TABLE IF NOT EXISTS d AS SELECT now() n;
+            COMMIT;
+            CREATE TABLE IF NOT EXISTS d2 AS SELECT now() n;
+            COMMIT;
+            """
+        )
 
     # When cmd_sync is run, because this MatView has `refresh triggers`
     # the view will be refreshed on every insert / update / truncate to d or d2
 
-    cmd_sync(args, [Treater])
+    cmd_sync(clean_db, [Treater])
 
-    with get_cursor(args) as c:
+    with get_cursor(clean_db) as c:
         c.execute("""SELECT * FROM public."Treater" """)
         vals = c.fetchall()
         assert len(vals) == 2
 
     # Add a value to one of the "watched" tables. The
     # materialized view should refresh.
-    with get_cursor(args) as c:
-        c.execute("INSERT INTO d SELECT now();")
-        c.execute("COMMIT;")
+    with get_cursor(clean_db) as c:
+        c.execute("INSERT INTO d SELECT now(); COMMIT;")
         c.execute("""SELECT * FROM public."Treater" """)
         vals = c.fetchall()
         assert len(vals) == 3
 
-    with get_cursor(args) as c:
-        c.execute("DROP TABLE IF EXISTS d CASCADE;")
-        c.execute("DROP TABLE IF EXISTS d2 CASCADE;")
-
-    cmd_nuke(args)
+    with get_cursor(clean_db) as c:
+        c.execute("DROP TABLE IF EXISTS d, d2 CASCADE;")
 
 
-def test_executable_sql():
+def test_executable_sql(clean_db):
     """
     SQL can be provided by a function rather
     than a static string
@@ -331,14 +361,13 @@ def test_executable_sql():
                 ${{postamble}};
             """
 
-    cmd_sync(args, [Now])
-    with get_cursor(args) as c:
-        c.execute(f"SELECT * FROM {Now.db_object_identity()}")
-    cmd_nuke(args)
+    cmd_sync(clean_db, [Now])
+    with get_cursor(clean_db) as c:
+        c.execute(probe_sql(Now))
     del Now
 
 
-def test_multiple_inheritance():
+def test_multiple_inheritance(clean_db):
     """
     A more complex inheritance example
     """
@@ -390,8 +419,118 @@ def test_multiple_inheritance():
             ${postamble};
         """
 
-    cmd_sync(args, [NowOne, NowTwo, NowThree, N4, N5, N6])
-    with get_cursor(args) as c:
-        c.execute(f"SELECT * FROM {N6.db_object_identity()}")
-    cmd_nuke(args)
+    cmd_sync(clean_db, [NowOne, NowTwo, NowThree, N4, N5, N6])
+    with get_cursor(clean_db) as c:
+        c.execute(probe_sql(N6))
     del N6
+
+
+def test_failing_action_is_attributed(clean_db):
+    """
+    Actions are sent to the database in one batch; a failure
+    must still be reported against the samizdat that caused it
+    """
+
+    class Fine(SamizdatView):
+        sql_template = """
+            ${preamble}
+            SELECT 1 AS x
+            ${postamble}
+        """
+
+    class Broken(SamizdatView):
+        deps_on = {Fine}
+        sql_template = """
+            ${preamble}
+            SELECT nonexistent FROM "Fine"
+            ${postamble}
+        """
+
+    try:
+        with pytest.raises(DatabaseError) as excinfo:
+            cmd_sync(clean_db, [Fine, Broken])
+        assert excinfo.value.samizdat is Broken
+
+        cmd_sync(clean_db, [Fine])
+        with get_cursor(clean_db) as c:
+            c.execute(probe_sql(Fine))
+    finally:
+        # keep them (and the exception referencing Broken) from being discovered by later tests
+        del excinfo, Fine, Broken
+        gc.collect()
+
+
+def test_error_survives_a_broken_connection(db_args):
+    """
+    The rollback on the way out must not replace the error raised inside the block
+    """
+    own_connection = ArgType(**{**vars(db_args), "connection": None})
+    with pytest.raises(ValueError, match="original"):
+        with get_cursor(own_connection) as c:
+            c.connection.close()
+            raise ValueError("original")
+
+
+def test_trigger_functionality(clean_db, fruit_pet_tables):
+    """
+    The synced trigger fires on insert; the rows are rolled back afterwards
+    """
+    cmd_sync(clean_db, [Raise, FruitCensor])
+    snapshot = catalog_snapshot(clean_db)
+    assert snapshot["FUNCTION"] == {"Raise"}
+    assert snapshot["TRIGGER"] == {"FruitCensor"}
+    dryrun = ArgType(**{**vars(clean_db), "txdiscipline": "dryrun"})
+
+    with get_cursor(dryrun) as c, pipelined(c):
+        c.executemany("""INSERT INTO "Fruit" VALUES (%s, %s)""", [(10, "mango"), (11, "lychee")])
+        c.execute("""SELECT count(*) FROM "Fruit" WHERE id >= 10""")
+        assert c.fetchone()[0] == 2
+
+    with pytest.raises(Exception, match="Too delicious"):
+        with get_cursor(dryrun) as c:
+            c.execute("""INSERT INTO "Fruit" VALUES (12, 'durian')""")
+
+
+def test_trigger_is_replaced_in_place(clean_db, fruit_pet_tables):
+    """
+    A redefined trigger is replaced rather than dropped and recreated
+    """
+    with get_cursor(clean_db) as c:
+        c.execute("SHOW server_version_num;")
+        if int(c.fetchone()[0]) < 140000:
+            pytest.skip("CREATE OR REPLACE TRIGGER needs PostgreSQL 14")
+
+    class FruitCensorV2(SamizdatTrigger):
+        object_name = "FruitCensor"
+        deps_on = {Raise}
+        on_table = "Fruit"
+        condition = "BEFORE INSERT"
+        sql_template = """
+            ${preamble}
+            FOR EACH ROW
+            WHEN (NEW.name ilike '%durian%')
+            EXECUTE PROCEDURE "Raise"('Too smelly.')
+        """
+
+    trigger_oid = """SELECT oid FROM pg_trigger WHERE tgname = 'FruitCensor' AND NOT tgisinternal"""
+    try:
+        cmd_sync(clean_db, [Raise, FruitCensor])
+        with get_cursor(clean_db) as c:
+            c.execute(trigger_oid)
+            [(oid_before,)] = c.fetchall()
+
+        cmd_sync(clean_db, [Raise, FruitCensorV2])
+        with get_cursor(clean_db) as c:
+            assert dbstate_equals_definedstate(c, [Raise, FruitCensorV2]).issame
+            c.execute(trigger_oid)
+            assert c.fetchall() == [(oid_before,)]
+
+        dryrun = ArgType(**{**vars(clean_db), "txdiscipline": "dryrun"})
+        with pytest.raises(Exception, match="Too smelly"):
+            with get_cursor(dryrun) as c:
+                c.execute("""INSERT INTO "Fruit" VALUES (12, 'durian')""")
+    finally:
+        # Don't leave the redefined trigger behind: it would clash with FruitCensor in later syncs
+        cmd_nuke(clean_db)
+        del FruitCensorV2
+        gc.collect()
@@ -0,0 +1,26 @@
+import pytest
+
+from dbsamizdat.samtypes import FQTuple
+from dbsamizdat.util import nodenamefmt
+from sample_app.test_samizdats import PetUppercase
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.mark.parametrize(
+    "node,expected",
+    [
+        ("Fruit", "Fruit"),
+        (("public", "Fruit"), "Fruit"),
+        ((None, "Fruit"), "Fruit"),
+        (("shop", "Fruit"), "shop.Fruit"),
+        (("public", "DealFruitFun", "name text"), "DealFruitFun(name text)"),
+        (("public", "DealFruitFun", ""), "DealFruitFun"),
+        (FQTuple("public", "Fruit"), "Fruit"),
+        (FQTuple("shop", "DealFruitFun", "name text"), "shop.DealFruitFun(name text)"),
+        # samizdat classes have an `object_name` too, but are formatted by `str`
+        (PetUppercase, str(PetUppercase)),
+    ],
+)
+def test_nodenamefmt(node, expected):
+    assert nodenamefmt(node) == expected